@@ -4,7 +4,13 @@ AutoTagger Application Factory
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
+from sqlalchemy import event
+import atexit
 import logging
+import logging.handlers
+import os
+import threading
+import time
 from pathlib import Path
 
 # Initialize extensions
@@ -30,6 +36,9 @@ def create_app(config_name='default'):
     db.init_app(app)
     CORS(app)
     
+    from app.tasks import celery_init_app
+    celery_init_app(app)
+    
     # Create necessary directories
     Path(app.config['UPLOAD_FOLDER']).mkdir(parents=True, exist_ok=True)
     Path(app.config['LOG_FILE']).parent.mkdir(parents=True, exist_ok=True)
@@ -45,25 +54,54 @@ def create_app(config_name='default'):
     from app.routes import api_bp
     app.register_blueprint(api_bp, url_prefix='/api')
     
-    # Create database tables
+    # Create database tables and load NLP models
+    from app.models import upgrade_schema
+    from app.processing import init_nlp_processor
     with app.app_context():
+        if db.engine.dialect.name == 'sqlite':
+            event.listen(db.engine, 'connect', set_sqlite_pragmas)
         db.create_all()
+        upgrade_schema()
+        init_nlp_processor(app)
     
     app.logger.info('AutoTagger application started')
     
     return app
 
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Let SQLite readers run alongside a writer (WAL) and enlarge its page cache"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA cache_size=-65536')  # 64MB
+    cursor.close()
+
+# Handlers installed by setup_logging, replaced when another app is created
+_log_handlers = []
+
+# Seconds between background flushes of buffered log records
+_log_flush_interval = None
+
 def setup_logging(app):
     """Configure application logging"""
     log_level = getattr(logging, app.config['LOG_LEVEL'])
     
     # File handler
-    file_handler = logging.FileHandler(app.config['LOG_FILE'])
+    file_handler = logging.FileHandler(app.config['LOG_FILE'], delay=True)
     file_handler.setLevel(log_level)
     file_handler.setFormatter(logging.Formatter(
         '[%(asctime)s] %(levelname)s in %(module)s: %(message)s'
     ))
     
+    # Buffer file writes; errors flush immediately, the rest periodically
+    buffered_handler = logging.handlers.MemoryHandler(
+        capacity=app.config['LOG_BUFFER_CAPACITY'],
+        flushLevel=logging.ERROR,
+        target=file_handler,
+        flushOnClose=True
+    )
+    buffered_handler.setLevel(log_level)
+    
     # Console handler
     console_handler = logging.StreamHandler()
     console_handler.setLevel(log_level)
@@ -71,7 +109,59 @@ def setup_logging(app):
         '%(levelname)s: %(message)s'
     ))
     
+    # Replace the handlers of a previously created app instead of stacking them
+    for logger, handler in _log_handlers:
+        logger.removeHandler(handler)
+        handler.close()
+    _log_handlers[:] = [(app.logger, buffered_handler), (app.logger, console_handler)]
+    
     # Add handlers
-    app.logger.addHandler(file_handler)
+    app.logger.addHandler(buffered_handler)
     app.logger.addHandler(console_handler)
-    app.logger.setLevel(log_level)
\ No newline at end of file
+    app.logger.setLevel(log_level)
+    
+    start_log_flusher(app.config['LOG_FLUSH_INTERVAL'])
+
+def flush_log_buffers():
+    """Write out records held by the buffered log handlers"""
+    for _, handler in _log_handlers:
+        if isinstance(handler, logging.handlers.MemoryHandler):
+            handler.flush()
+
+def _clear_log_buffers():
+    """Drop buffered records in a forked child; the parent still writes them"""
+    for _, handler in _log_handlers:
+        if isinstance(handler, logging.handlers.MemoryHandler):
+            with handler.lock:
+                handler.buffer.clear()
+
+def _start_flusher_thread():
+    def flush_periodically():
+        while True:
+            time.sleep(_log_flush_interval)
+            flush_log_buffers()
+    
+    threading.Thread(target=flush_periodically, name='log-flusher', daemon=True).start()
+
+def _after_fork_in_child():
+    _clear_log_buffers()
+    _start_flusher_thread()
+
+def start_log_flusher(interval):
+    """
+    Flush buffered log handlers every `interval` seconds in the background
+    
+    The thread, exit flush and fork hooks are set up once per process;
+    later calls only update the interval.
+    """
+    global _log_flush_interval
+    started = _log_flush_interval is not None
+    _log_flush_interval = interval
+    if started:
+        return
+    
+    _start_flusher_thread()
+    atexit.register(flush_log_buffers)
+    # Flush before fork() so children don't inherit pending records, and
+    # restart the flusher in the child since threads don't survive fork()
+    os.register_at_fork(before=flush_log_buffers, after_in_child=_after_fork_in_child)
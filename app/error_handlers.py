@@ -3,10 +3,18 @@ Error handlers and validation utilities
 """
 from flask import jsonify
 from werkzeug.exceptions import HTTPException
+from pathlib import PureWindowsPath
 import logging
+import warnings
 
 logger = logging.getLogger(__name__)
 
+# Allowed values of a tag's 'tag_type'
+_VALID_TAG_TYPES = frozenset(('keyword', 'entity', 'custom'))
+
+# Characters stripped from filenames by sanitize_filename
+_FILENAME_STRIP_TABLE = str.maketrans('', '', '~$&|;`<>')
+
 def register_error_handlers(app):
     """Register error handlers with Flask app"""
     
@@ -72,7 +80,7 @@ class ValidationError(Exception):
     """Custom validation error"""
     pass
 
-def validate_file_upload(file, allowed_extensions, max_size=None):
+def validate_file_upload(file, allowed_extensions, max_size=None, content_length=None):
     """
     Validate uploaded file
     
@@ -80,11 +88,12 @@ def validate_file_upload(file, allowed_extensions, max_size=None):
         file: Flask file object
         allowed_extensions: Set of allowed extensions
         max_size: Maximum file size in bytes
+        content_length: Request Content-Length, used as the size when given
         
     Returns:
         Tuple of (is_valid, error_message)
     """
-    if not file:
+    if file is None:
         return False, "No file provided"
     
     if file.filename == '':
@@ -100,11 +109,16 @@ def validate_file_upload(file, allowed_extensions, max_size=None):
     
     # Check file size if max_size provided
     if max_size:
-        file.seek(0, 2)  # Seek to end
-        size = file.tell()
-        file.seek(0)  # Reset to beginning
+        size = content_length
         
-        if size > max_size:
+        # Only seek when the request size is unknown, as seeking may force
+        # Werkzeug to spool the upload to disk
+        if size is None and file.stream.seekable():
+            file.seek(0, 2)  # Seek to end
+            size = file.tell()
+            file.seek(0)  # Reset to beginning
+        
+        if size is not None and size > max_size:
             return False, f"File size exceeds maximum of {max_size / (1024*1024):.0f}MB"
     
     return True, None
@@ -122,37 +136,43 @@ def validate_tag_data(data):
     if not isinstance(data, dict):
         return False, "Invalid data format"
     
+    has_add = 'add_tags' in data
+    has_remove = 'remove_tag_ids' in data
+    
+    # Must have at least one operation
+    if not has_add and not has_remove:
+        return False, "Must provide either 'add_tags' or 'remove_tag_ids'"
+    
     # Validate add_tags if present
-    if 'add_tags' in data:
-        if not isinstance(data['add_tags'], list):
+    if has_add:
+        add_tags = data['add_tags']
+        if not isinstance(add_tags, list):
             return False, "'add_tags' must be a list"
         
-        for tag in data['add_tags']:
+        for tag in add_tags:
             if not isinstance(tag, dict):
                 return False, "Each tag in 'add_tags' must be a dictionary"
             
             if 'tag_name' not in tag:
                 return False, "Each tag must have 'tag_name'"
             
-            if not isinstance(tag['tag_name'], str) or not tag['tag_name'].strip():
+            tag_name = tag['tag_name']
+            if not isinstance(tag_name, str) or not tag_name.strip():
                 return False, "'tag_name' must be a non-empty string"
             
-            if 'tag_type' in tag and tag['tag_type'] not in ['keyword', 'entity', 'custom']:
+            if 'tag_type' in tag and tag['tag_type'] not in _VALID_TAG_TYPES:
                 return False, "'tag_type' must be 'keyword', 'entity', or 'custom'"
     
     # Validate remove_tag_ids if present
-    if 'remove_tag_ids' in data:
-        if not isinstance(data['remove_tag_ids'], list):
+    if has_remove:
+        remove_tag_ids = data['remove_tag_ids']
+        if not isinstance(remove_tag_ids, list):
             return False, "'remove_tag_ids' must be a list"
         
-        for tag_id in data['remove_tag_ids']:
+        for tag_id in remove_tag_ids:
             if not isinstance(tag_id, int) or tag_id <= 0:
                 return False, "Each tag ID must be a positive integer"
     
-    # Must have at least one operation
-    if 'add_tags' not in data and 'remove_tag_ids' not in data:
-        return False, "Must provide either 'add_tags' or 'remove_tag_ids'"
-    
     return True, None
 
 def validate_pagination_params(page, per_page, max_per_page=100):
@@ -182,18 +202,22 @@ def sanitize_filename(filename):
     """
     Sanitize filename to prevent directory traversal
     
+    Deprecated: use werkzeug.utils.secure_filename, as the upload route does.
+    
     Args:
         filename: Original filename
         
     Returns:
         Sanitized filename
     """
-    # Remove path components
-    filename = filename.split('/')[-1].split('\\')[-1]
+    warnings.warn(
+        "sanitize_filename is deprecated, use werkzeug.utils.secure_filename",
+        DeprecationWarning,
+        stacklevel=2
+    )
     
-    # Remove potentially dangerous characters
-    dangerous_chars = ['..', '~', '$', '&', '|', ';', '`', '<', '>']
-    for char in dangerous_chars:
-        filename = filename.replace(char, '')
+    # Remove path components (both / and \ separators)
+    filename = PureWindowsPath(filename).name
     
-    return filename
\ No newline at end of file
+    # Remove potentially dangerous characters
+    return filename.replace('..', '').translate(_FILENAME_STRIP_TABLE)
\ No newline at end of file
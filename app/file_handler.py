@@ -3,27 +3,38 @@ File handling utilities for document upload and text extraction
 """
 import os
 import logging
+import shutil
+import uuid
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 
 import PyPDF2
 import pdfplumber
 
 logger = logging.getLogger(__name__)
 
+# Default chunk size used when streaming uploads to disk
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
 class FileHandler:
     """Handle file operations and text extraction"""
     
-    def __init__(self, upload_folder: str, allowed_extensions: set):
+    def __init__(self, upload_folder: str, allowed_extensions: set,
+                 pdf_fallback_max_pages: int = 50, upload_chunk_size: int = UPLOAD_CHUNK_SIZE):
         """
         Initialize file handler
         
         Args:
             upload_folder: Directory to store uploaded files
             allowed_extensions: Set of allowed file extensions
+            pdf_fallback_max_pages: Maximum number of empty PyPDF2 pages to
+                retry with pdfplumber (more usually means a scanned PDF)
+            upload_chunk_size: Bytes copied per read when saving uploads
         """
         self.upload_folder = Path(upload_folder)
-        self.allowed_extensions = allowed_extensions
+        self.allowed_extensions = frozenset(allowed_extensions)
+        self.pdf_fallback_max_pages = pdf_fallback_max_pages
+        self.upload_chunk_size = upload_chunk_size
         
         # Ensure upload folder exists
         self.upload_folder.mkdir(parents=True, exist_ok=True)
@@ -38,8 +49,8 @@ class FileHandler:
         Returns:
             True if file is allowed, False otherwise
         """
-        return '.' in filename and \
-               filename.rsplit('.', 1)[1].lower() in self.allowed_extensions
+        _, dot, extension = filename.rpartition('.')
+        return bool(dot) and extension.lower() in self.allowed_extensions
     
     def save_file(self, file, filename: str) -> Tuple[bool, str, Optional[Path]]:
         """
@@ -56,16 +67,19 @@ class FileHandler:
             if not self.allowed_file(filename):
                 return False, f"File type not allowed. Allowed types: {', '.join(self.allowed_extensions)}", None
             
-            # Generate unique filename if file already exists
+            # Create the file exclusively; if the name is taken, add a random
+            # suffix instead of probing name_1, name_2, ...
             filepath = self.upload_folder / filename
-            counter = 1
-            while filepath.exists():
+            try:
+                out = open(filepath, 'xb')
+            except FileExistsError:
                 name, ext = os.path.splitext(filename)
-                filepath = self.upload_folder / f"{name}_{counter}{ext}"
-                counter += 1
+                filepath = self.upload_folder / f"{name}_{uuid.uuid4().hex[:10]}{ext}"
+                out = open(filepath, 'xb')
             
-            # Save file
-            file.save(str(filepath))
+            # Stream file to disk in large chunks
+            with out:
+                shutil.copyfileobj(file.stream, out, length=self.upload_chunk_size)
             logger.info(f"File saved: {filepath}")
             
             return True, "File saved successfully", filepath
@@ -85,8 +99,10 @@ class FileHandler:
             Tuple of (success, message, content)
         """
         try:
-            with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
-                content = f.read()
+            if filepath.stat().st_size == 0:
+                return False, "File is empty", None
+            
+            content = filepath.read_text(encoding='utf-8', errors='ignore')
             
             if not content.strip():
                 return False, "File is empty", None
@@ -102,55 +118,79 @@ class FileHandler:
         """
         Extract text from PDF file using multiple methods
         
+        PyPDF2 parses the file once; the much slower pdfplumber only
+        re-extracts the pages PyPDF2 returned no text for.
+        
         Args:
             filepath: Path to PDF file
             
         Returns:
             Tuple of (success, message, content)
         """
-        # Try pdfplumber first (better for complex PDFs)
-        content = self._extract_with_pdfplumber(filepath)
+        pages = self._extract_with_pypdf2(filepath)
+        
+        if pages is None:
+            # PyPDF2 could not parse the file, let pdfplumber try all pages
+            texts = self._extract_with_pdfplumber(filepath)
+            pages = [texts[i] for i in sorted(texts)]
+        else:
+            empty_pages = [i for i, text in enumerate(pages) if not text.strip()]
+            if empty_pages and len(empty_pages) <= self.pdf_fallback_max_pages:
+                recovered = self._extract_with_pdfplumber(filepath, empty_pages)
+                for i, text in recovered.items():
+                    pages[i] = text
         
-        # If pdfplumber fails, try PyPDF2
-        if not content:
-            content = self._extract_with_pypdf2(filepath)
+        content = '\n'.join(text for text in pages if text)
         
-        if not content:
+        if not content.strip():
             return False, "Could not extract text from PDF. File may be scanned or corrupted.", None
         
         logger.info(f"Extracted {len(content)} characters from PDF file")
         return True, "Text extracted successfully", content
     
-    def _extract_with_pdfplumber(self, filepath: Path) -> Optional[str]:
-        """Extract text using pdfplumber"""
+    def _extract_with_pdfplumber(self, filepath: Path,
+                                 page_numbers: Optional[List[int]] = None) -> Dict[int, str]:
+        """
+        Extract text using pdfplumber
+        
+        Args:
+            filepath: Path to PDF file
+            page_numbers: Zero-based page indices to extract (default: all)
+            
+        Returns:
+            Dictionary of page index to text (empty on failure)
+        """
         try:
-            text_parts = []
+            texts = {}
             with pdfplumber.open(filepath) as pdf:
-                for page in pdf.pages:
-                    text = page.extract_text()
-                    if text:
-                        text_parts.append(text)
-            
-            content = '\n'.join(text_parts)
-            return content if content.strip() else None
+                if page_numbers is None:
+                    page_numbers = range(len(pdf.pages))
+                for i in page_numbers:
+                    page = pdf.pages[i]
+                    texts[i] = page.extract_text() or ''
+                    # Release the page's cached layout objects right away
+                    # instead of keeping every parsed page alive until close
+                    page.flush_cache()
+            return texts
             
         except Exception as e:
             logger.warning(f"pdfplumber extraction failed: {e}")
-            return None
+            return {}
     
-    def _extract_with_pypdf2(self, filepath: Path) -> Optional[str]:
-        """Extract text using PyPDF2"""
+    def _extract_with_pypdf2(self, filepath: Path) -> Optional[List[str]]:
+        """
+        Extract text using PyPDF2
+        
+        Args:
+            filepath: Path to PDF file
+            
+        Returns:
+            List with the text of every page, or None if the file can't be parsed
+        """
         try:
-            text_parts = []
             with open(filepath, 'rb') as f:
-                pdf_reader = PyPDF2.PdfReader(f)
-                for page in pdf_reader.pages:
-                    text = page.extract_text()
-                    if text:
-                        text_parts.append(text)
-            
-            content = '\n'.join(text_parts)
-            return content if content.strip() else None
+                pdf_reader = PyPDF2.PdfReader(f, strict=False)
+                return [page.extract_text() or '' for page in pdf_reader.pages]
             
         except Exception as e:
             logger.warning(f"PyPDF2 extraction failed: {e}")
@@ -3,7 +3,11 @@ Database Models for AutoTagger
 """
 from app import db
 from datetime import datetime
-from sqlalchemy import Index
+from sqlalchemy import Index, MetaData, Table, UniqueConstraint, inspect, text
+from sqlalchemy.orm import deferred
+import logging
+
+logger = logging.getLogger(__name__)
 
 class Document(db.Model):
     """Document model for storing uploaded documents"""
@@ -11,23 +15,38 @@ class Document(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(255), nullable=False)
-    content = db.Column(db.Text, nullable=False)
+    content = deferred(db.Column(db.Text, nullable=False))  # Loaded on access or with undefer()
     upload_date = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     processed = db.Column(db.Boolean, default=False, nullable=False)
     file_size = db.Column(db.Integer)  # Size in bytes
     file_type = db.Column(db.String(10))  # txt or pdf
+    tfidf_vector = deferred(db.Column(db.LargeBinary))  # Serialized similarity vector
+    content_hash = db.Column(db.String(32), unique=True, index=True)  # BLAKE2b hex digest of content
+    processing_error = db.Column(db.String(255))  # Set when background processing gave up
     
     # Relationship with tags
     tags = db.relationship('Tag', backref='document', lazy='dynamic', cascade='all, delete-orphan')
     
-    # Index for faster queries
+    # Read-only, loadable view of the same tags (supports selectinload)
+    tags_list = db.relationship('Tag', lazy='select', viewonly=True, order_by='Tag.id')
+    
+    # Indexes for listing by date, optionally filtered by processing status
     __table_args__ = (
         Index('idx_upload_date', 'upload_date'),
-        Index('idx_processed', 'processed'),
+        Index('idx_processed_date', 'processed', 'upload_date'),
     )
     
-    def to_dict(self, include_content=False):
-        """Convert document to dictionary"""
+    def to_dict(self, include_content=False, tag_count=None):
+        """
+        Convert document to dictionary
+        
+        Args:
+            include_content: Include the full document content
+            tag_count: Precomputed number of tags (avoids a COUNT query)
+        """
+        if tag_count is None:
+            tag_count = self.tags.count()
+        
         data = {
             'id': self.id,
             'filename': self.filename,
@@ -35,7 +54,7 @@ class Document(db.Model):
             'processed': self.processed,
             'file_size': self.file_size,
             'file_type': self.file_type,
-            'tag_count': self.tags.count()
+            'tag_count': tag_count
         }
         if include_content:
             data['content'] = self.content
@@ -56,27 +75,96 @@ class Tag(db.Model):
     entity_type = db.Column(db.String(50))  # PERSON, ORG, GPE, etc. (for NER tags)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
-    # Indexes for faster queries
+    # Indexes matching the access patterns (tags of a document by type or
+    # confidence, tags by name, tag statistics by type); a tag appears once
+    # per document
     __table_args__ = (
-        Index('idx_document_id', 'document_id'),
-        Index('idx_tag_name', 'tag_name'),
-        Index('idx_tag_type', 'tag_type'),
-        Index('idx_confidence', 'confidence_score'),
+        Index('idx_doc_type', 'document_id', 'tag_type'),
+        Index('idx_name_type', 'tag_name', 'tag_type'),
+        Index('idx_type_name', 'tag_type', 'tag_name'),
+        Index('idx_doc_conf', 'document_id', 'confidence_score'),
+        UniqueConstraint('document_id', 'tag_name', 'tag_type', name='uq_doc_tag'),
     )
     
+    # Columns needed by row_to_dict, for queries that skip building Tag objects
+    DICT_COLUMNS = ('id', 'document_id', 'tag_name', 'tag_type',
+                    'confidence_score', 'entity_type', 'created_at')
+    
     def to_dict(self):
         """Convert tag to dictionary"""
+        return Tag.row_to_dict(self)
+    
+    @staticmethod
+    def row_to_dict(row):
+        """Convert a Tag or a result row with the DICT_COLUMNS to dictionary"""
         data = {
-            'id': self.id,
-            'document_id': self.document_id,
-            'tag_name': self.tag_name,
-            'tag_type': self.tag_type,
-            'confidence_score': round(self.confidence_score, 3),
-            'created_at': self.created_at.isoformat()
+            'id': row.id,
+            'document_id': row.document_id,
+            'tag_name': row.tag_name,
+            'tag_type': row.tag_type,
+            'confidence_score': round(row.confidence_score, 3),
+            'created_at': row.created_at.isoformat()
         }
-        if self.entity_type:
-            data['entity_type'] = self.entity_type
+        if row.entity_type:
+            data['entity_type'] = row.entity_type
         return data
     
     def __repr__(self):
-        return f'<Tag {self.tag_name} ({self.tag_type})>'
\ No newline at end of file
+        return f'<Tag {self.tag_name} ({self.tag_type})>'
+
+# Indexes of earlier versions that were replaced by the composite ones above
+OBSOLETE_INDEXES = {
+    'documents': ('idx_processed',),
+    'tags': ('idx_document_id', 'idx_tag_name', 'idx_tag_type', 'idx_confidence'),
+}
+
+def upgrade_schema():
+    """
+    Bring tables created by an earlier version up to date
+    
+    db.create_all() only creates missing tables, so columns and indexes
+    added since are created here and replaced indexes are dropped.
+    Duplicate tags are removed before the unique tag index is created.
+    """
+    engine = db.engine
+    inspector = inspect(engine)
+    
+    with engine.begin() as conn:
+        for table in (Document.__table__, Tag.__table__):
+            columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in columns:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                    logger.info(f"Added column {table.name}.{column.name}")
+            
+            indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            indexes.update(
+                constraint['name'] for constraint in inspector.get_unique_constraints(table.name)
+            )
+            
+            obsolete = indexes.intersection(OBSOLETE_INDEXES[table.name])
+            if obsolete:
+                # Drop through the reflected indexes so each dialect gets its own DDL
+                reflected = Table(table.name, MetaData(), autoload_with=conn)
+                for index in reflected.indexes:
+                    if index.name in obsolete:
+                        index.drop(conn)
+                        logger.info(f"Dropped index {index.name}")
+            
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(conn)
+                    logger.info(f"Created index {index.name}")
+            
+            if table is Tag.__table__ and 'uq_doc_tag' not in indexes:
+                # The derived table lets MySQL read the table it deletes from
+                conn.execute(text(
+                    'DELETE FROM tags WHERE id NOT IN (SELECT keep_id FROM ('
+                    'SELECT MIN(id) AS keep_id FROM tags '
+                    'GROUP BY document_id, tag_name, tag_type) AS keep)'
+                ))
+                conn.execute(text(
+                    'CREATE UNIQUE INDEX uq_doc_tag ON tags (document_id, tag_name, tag_type)'
+                ))
+                logger.info("Created index uq_doc_tag")
@@ -1,21 +1,54 @@
 """
 NLP Processing Module for AutoTagger
 Handles keyword extraction, NER, and document similarity
+
+spaCy, scikit-learn and SciPy are imported on first use so that importing
+this module (and booting a worker) stays cheap.
 """
 import logging
+import os
+import pickle
 import re
+import tempfile
+from collections import Counter
+from functools import cached_property
+from pathlib import Path
 from typing import List, Dict, Tuple
 
-import nltk
-import spacy
-from nltk.corpus import stopwords
-from nltk.stem import WordNetLemmatizer
-from nltk.tokenize import word_tokenize
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
+# Vocabulary cap for the corpus-wide TF-IDF fit (pairwise similarity fits use 1000)
+CORPUS_MAX_FEATURES = 100000
+
+# Tokenization only needs the tokenizer, tagger and lemmatizer
+TOKENIZE_DISABLE = ['ner', 'parser']
+
+# Entity labels kept as tags
+ENTITY_LABELS = frozenset({'PERSON', 'ORG', 'GPE', 'LOC', 'PRODUCT', 'EVENT', 'WORK_OF_ART'})
+
+# URLs, email addresses and runs of special characters, stripped in one pass
+_PREPROCESS_RE = re.compile(r'http\S+|www\.\S+|\S+@\S+|[^a-zA-Z0-9\s]+')
+_WS_RE = re.compile(r'\s+')
+
+# Feature space of the stored per-document similarity vectors
+SIMILARITY_N_FEATURES = 2 ** 18
+
+def _dump_vector(vector) -> bytes:
+    """Serialize a single-row sparse vector as int32 column indices then float32 values"""
+    vector = vector.tocsr()
+    return vector.indices.astype(np.int32).tobytes() + vector.data.astype(np.float32).tobytes()
+
+def _load_vector(blob: bytes):
+    """Deserialize a stored document vector"""
+    from scipy import sparse
+    
+    nnz = len(blob) // 8
+    indices = np.frombuffer(blob, dtype=np.int32, count=nnz)
+    data = np.frombuffer(blob, dtype=np.float32, count=nnz, offset=4 * nnz)
+    return sparse.csr_matrix((data, indices, [0, nnz]), shape=(1, SIMILARITY_N_FEATURES))
+
 class NLPProcessor:
     """Main NLP processing class for document analysis"""
     
@@ -30,68 +63,197 @@ class NLPProcessor:
         self.max_keywords = max_keywords
         self.min_keyword_length = min_keyword_length
         
-        # Initialize NLTK components
-        self._init_nltk()
-        
-        # Initialize spaCy
+        # Corpus-fitted TF-IDF vectorizer and the IDF given to terms outside
+        # its vocabulary, swapped together (None until fit_corpus/load_vectorizer).
+        # Once fitted it is only read, so it is safe to share across requests.
+        self._vocabulary = (None, None)
+        self.corpus_size = 0
+    
+    @cached_property
+    def nlp(self):
+        """spaCy pipeline, or None if the model is unavailable"""
+        import spacy
         try:
-            self.nlp = spacy.load('en_core_web_sm')
+            nlp = spacy.load('en_core_web_sm')
             logger.info("spaCy model loaded successfully")
+            return nlp
         except Exception as e:
             logger.warning(f"Could not load spaCy model: {e}")
             logger.warning("Run: python -m spacy download en_core_web_sm")
-            self.nlp = None
-        
-        # Initialize TF-IDF vectorizer
-        self.tfidf_vectorizer = TfidfVectorizer(
-            max_features=1000,
+            return None
+    
+    @cached_property
+    def tok_nlp(self):
+        """
+        Pipeline used for tokenization: the loaded model, or the bare English
+        tokenizer (no lemmas) when the model is unavailable
+        """
+        if self.nlp is not None:
+            return self.nlp
+        import spacy
+        return spacy.blank('en')
+    
+    @cached_property
+    def hashing_vectorizer(self):
+        """
+        Stateless vectorizer for the stored similarity vectors: raw term
+        counts, IDF is applied at query time over the compared documents
+        """
+        from sklearn.feature_extraction.text import HashingVectorizer
+        return HashingVectorizer(
+            n_features=SIMILARITY_N_FEATURES,
+            stop_words='english',
+            ngram_range=(1, 2),
+            alternate_sign=False,
+            norm=None,
+            dtype=np.float32
+        )
+    
+    @cached_property
+    def keyword_analyzer(self):
+        """Tokenizer producing the unigram and bigram terms scored as keywords"""
+        return self._build_tfidf_vectorizer().build_analyzer()
+    
+    @property
+    def tfidf_vectorizer(self):
+        """Corpus-fitted TF-IDF vectorizer, or None if not fitted yet"""
+        return self._vocabulary[0]
+    
+    def warm_up(self):
+        """Load all lazily initialized models"""
+        self.nlp
+        self.tok_nlp
+        self.hashing_vectorizer
+        self.keyword_analyzer
+    
+    def _build_tfidf_vectorizer(self, max_features=1000):
+        """Create a new, unfitted TF-IDF vectorizer with the standard settings"""
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        return TfidfVectorizer(
+            max_features=max_features,
             stop_words='english',
             ngram_range=(1, 2),  # Support unigrams and bigrams
             min_df=1
         )
+    
+    def fit_corpus(self, texts: List[str]) -> bool:
+        """
+        Fit the shared TF-IDF vectorizer once over a corpus of documents
         
-        self.lemmatizer = WordNetLemmatizer()
-        self.stop_words = set(stopwords.words('english'))
+        Args:
+            texts: Raw document contents
+            
+        Returns:
+            True if the vectorizer was fitted, False otherwise
+        """
+        processed = [self.preprocess_text(text) for text in texts if text]
+        if not processed:
+            return False
+        
+        try:
+            vectorizer = self._build_tfidf_vectorizer(max_features=CORPUS_MAX_FEATURES)
+            vectorizer.fit(processed)
+        except ValueError as e:
+            logger.warning(f"Could not fit TF-IDF vectorizer on corpus: {e}")
+            return False
+        
+        self._set_vocabulary(vectorizer, len(processed))
+        logger.info(f"TF-IDF vectorizer fitted on {len(processed)} documents")
+        return True
     
-    def _init_nltk(self):
-        """Download required NLTK data"""
-        required_data = ['punkt', 'stopwords', 'wordnet', 'averaged_perceptron_tagger']
-        for data in required_data:
-            try:
-                nltk.data.find(f'tokenizers/{data}')
-            except LookupError:
-                try:
-                    nltk.download(data, quiet=True)
-                    logger.info(f"Downloaded NLTK data: {data}")
-                except Exception as e:
-                    logger.warning(f"Could not download NLTK data {data}: {e}")
+    def _set_vocabulary(self, vectorizer, corpus_size: int):
+        """Swap in a fitted vectorizer together with its out-of-vocabulary IDF"""
+        # Smoothed IDF of a term no corpus document contains, ln((1 + n) / 1) + 1,
+        # the highest IDF the corpus can give
+        oov_idf = float(np.log1p(corpus_size)) + 1.0
+        self._vocabulary = (vectorizer, oov_idf)
+        self.corpus_size = corpus_size
     
-    def preprocess_text(self, text: str) -> str:
+    def vocabulary_is_stale(self, corpus_size: int) -> bool:
         """
-        Preprocess text: lowercase, remove special chars, etc.
+        Check whether the TF-IDF vocabulary should be (re)fitted
         
         Args:
-            text: Input text
+            corpus_size: Current number of documents
             
         Returns:
-            Preprocessed text
+            True if not fitted yet or the corpus has doubled since the fit
+        """
+        return self.tfidf_vectorizer is None or corpus_size >= 2 * self.corpus_size
+    
+    def save_vectorizer(self, path: Path, corpus_size: int) -> bool:
         """
-        # Convert to lowercase
-        text = text.lower()
+        Pickle the fitted TF-IDF vectorizer to disk
         
-        # Remove URLs
-        text = re.sub(r'http\S+|www.\S+', '', text)
+        The file is written under a temporary name and renamed into place, so
+        processes loading it concurrently never see a partial pickle.
         
-        # Remove email addresses
-        text = re.sub(r'\S+@\S+', '', text)
+        Args:
+            path: Destination file
+            corpus_size: Number of documents the vectorizer was fitted on
+            
+        Returns:
+            True if saved, False otherwise
+        """
+        if self.tfidf_vectorizer is None:
+            return False
+        
+        path = Path(path)
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.')
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump({'corpus_size': corpus_size,
+                             'vectorizer': self.tfidf_vectorizer}, f)
+            os.replace(tmp_path, path)
+            return True
+        except Exception as e:
+            logger.warning(f"Could not save TF-IDF vectorizer: {e}")
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            return False
+    
+    def load_vectorizer(self, path: Path, corpus_size: int) -> bool:
+        """
+        Load a pickled TF-IDF vectorizer unless it is stale for the current corpus
+        
+        Args:
+            path: Pickle file written by save_vectorizer
+            corpus_size: Current number of documents
+            
+        Returns:
+            True if a matching vectorizer was loaded, False otherwise
+        """
+        path = Path(path)
+        if not path.exists():
+            return False
         
-        # Remove special characters but keep spaces
-        text = re.sub(r'[^a-zA-Z0-9\s]', ' ', text)
+        try:
+            with open(path, 'rb') as f:
+                data = pickle.load(f)
+        except Exception as e:
+            logger.warning(f"Could not load TF-IDF vectorizer: {e}")
+            return False
         
-        # Remove extra whitespace
-        text = ' '.join(text.split())
+        fitted_size = data.get('corpus_size', 0)
+        if not fitted_size <= corpus_size < 2 * fitted_size:
+            return False
         
-        return text
+        self._set_vocabulary(data['vectorizer'], fitted_size)
+        logger.info("TF-IDF vectorizer loaded from cache")
+        return True
+    
+    def preprocess_text(self, text: str) -> str:
+        """
+        Preprocess text: lowercase, remove special chars, etc.
+        
+        Args:
+            text: Input text
+            
+        Returns:
+            Preprocessed text
+        """
+        return _WS_RE.sub(' ', _PREPROCESS_RE.sub(' ', text.lower())).strip()
     
     def tokenize_and_lemmatize(self, text: str) -> List[str]:
         """
@@ -103,17 +265,13 @@ class NLPProcessor:
         Returns:
             List of lemmatized tokens
         """
-        # Tokenize
-        tokens = word_tokenize(text)
-        
-        # Remove stopwords and short words, then lemmatize
-        lemmatized = [
-            self.lemmatizer.lemmatize(token)
-            for token in tokens
-            if token not in self.stop_words and len(token) >= self.min_keyword_length
+        doc = self.tok_nlp(text, disable=TOKENIZE_DISABLE)
+        return [
+            token.lemma_ or token.text
+            for token in doc
+            if not (token.is_stop or token.is_punct or token.is_space)
+            and len(token) >= self.min_keyword_length
         ]
-        
-        return lemmatized
     
     def extract_keywords_tfidf(self, text: str, top_n: int = None) -> List[Tuple[str, float]]:
         """
@@ -133,20 +291,36 @@ class NLPProcessor:
             # Preprocess text
             processed_text = self.preprocess_text(text)
             
-            # Fit and transform
-            tfidf_matrix = self.tfidf_vectorizer.fit_transform([processed_text])
+            # Term frequencies of this document, terms in alphabetical order
+            counts = Counter(self.keyword_analyzer(processed_text))
+            terms = sorted(counts)
+            k = min(top_n, len(terms))
+            if k <= 0:
+                return []
+            scores = np.fromiter((counts[term] for term in terms), dtype=np.float64, count=len(terms))
             
-            # Get feature names and scores
-            feature_names = self.tfidf_vectorizer.get_feature_names_out()
-            scores = tfidf_matrix.toarray()[0]
+            # Weight by the corpus IDF; terms the corpus has never seen get the
+            # highest IDF instead of being dropped. Before a corpus is fitted
+            # every IDF is 1, as for a single-document fit.
+            vectorizer, oov_idf = self._vocabulary
+            if vectorizer is not None:
+                vocabulary, idf = vectorizer.vocabulary_, vectorizer.idf_
+                scores *= np.fromiter(
+                    (idf[vocabulary[term]] if term in vocabulary else oov_idf for term in terms),
+                    dtype=np.float64,
+                    count=len(terms)
+                )
+            scores /= np.linalg.norm(scores)
             
-            # Create keyword-score pairs
-            keyword_scores = [(feature_names[i], scores[i]) 
-                            for i in range(len(feature_names)) if scores[i] > 0]
+            # Select the top N scores without sorting every term; ties at the
+            # cut-off go to the alphabetically first terms, like a full sort
+            kth = np.partition(scores, scores.size - k)[scores.size - k]
+            above = np.flatnonzero(scores > kth)
+            ties = np.flatnonzero(scores == kth)[:k - above.size]
+            top = np.sort(np.concatenate([above, ties]))
+            top = top[np.argsort(-scores[top], kind='stable')]
             
-            # Sort by score and return top N
-            keyword_scores.sort(key=lambda x: x[1], reverse=True)
-            return keyword_scores[:top_n]
+            return [(terms[i], float(scores[i])) for i in top]
             
         except Exception as e:
             logger.error(f"Error extracting keywords with TF-IDF: {e}")
@@ -169,26 +343,20 @@ class NLPProcessor:
         try:
             doc = self.nlp(text)
             
-            entities = []
+            # Filter relevant entity types, removing duplicates while
+            # preserving order
+            entities = {}
             for ent in doc.ents:
-                # Filter relevant entity types
-                if ent.label_ in ['PERSON', 'ORG', 'GPE', 'LOC', 'PRODUCT', 'EVENT', 'WORK_OF_ART']:
-                    entities.append({
-                        'text': ent.text,
-                        'label': ent.label_,
-                        'confidence': 0.8  # spaCy doesn't provide confidence scores directly
-                    })
-            
-            # Remove duplicates while preserving order
-            seen = set()
-            unique_entities = []
-            for ent in entities:
-                key = (ent['text'].lower(), ent['label'])
-                if key not in seen:
-                    seen.add(key)
-                    unique_entities.append(ent)
+                if ent.label_ in ENTITY_LABELS:
+                    key = (ent.text.casefold(), ent.label_)
+                    if key not in entities:
+                        entities[key] = {
+                            'text': ent.text,
+                            'label': ent.label_,
+                            'confidence': 0.8  # spaCy doesn't provide confidence scores directly
+                        }
             
-            return unique_entities
+            return list(entities.values())
             
         except Exception as e:
             logger.error(f"Error extracting entities: {e}")
@@ -218,9 +386,13 @@ class NLPProcessor:
                 'confidence_score': float(score)
             })
         
-        # Extract entities
+        # Extract entities (one tag per name, even if spaCy gave it several labels)
         entities = self.extract_entities(text)
+        seen_names = set()
         for entity in entities:
+            if entity['text'] in seen_names:
+                continue
+            seen_names.add(entity['text'])
             tags['entities'].append({
                 'tag_name': entity['text'],
                 'tag_type': 'entity',
@@ -247,11 +419,12 @@ class NLPProcessor:
             doc1 = self.preprocess_text(doc1_content)
             doc2 = self.preprocess_text(doc2_content)
             
-            # Create TF-IDF vectors
-            tfidf_matrix = self.tfidf_vectorizer.fit_transform([doc1, doc2])
+            # Create TF-IDF vectors with a local vectorizer so the shared,
+            # corpus-fitted one is never refitted
+            tfidf_matrix = self._build_tfidf_vectorizer().fit_transform([doc1, doc2])
             
-            # Calculate cosine similarity
-            similarity = cosine_similarity(tfidf_matrix[0:1], tfidf_matrix[1:2])[0][0]
+            # Rows are L2-normalized, so their dot product is the cosine similarity
+            similarity = tfidf_matrix[0].multiply(tfidf_matrix[1]).sum()
             
             return float(similarity)
             
@@ -259,48 +432,77 @@ class NLPProcessor:
             logger.error(f"Error calculating similarity: {e}")
             return 0.0
     
-    def find_similar_documents(self, target_content: str, 
-                              document_contents: List[Tuple[int, str]], 
-                              threshold: float = 0.3) -> List[Tuple[int, float]]:
+    def vectorize_document(self, content: str) -> bytes:
         """
-        Find similar documents based on content
+        Build the stored similarity vector for a document
         
         Args:
-            target_content: Content of target document
-            document_contents: List of (doc_id, content) tuples
+            content: Document content
+            
+        Returns:
+            Serialized sparse term-count vector
+        """
+        vector = self.hashing_vectorizer.transform([self.preprocess_text(content)])
+        return _dump_vector(vector)
+    
+    def find_similar_documents(self, target_vector: bytes,
+                              document_vectors: List[Tuple[int, bytes]],
+                              threshold: float = 0.3,
+                              limit: int = None) -> List[Tuple[int, float]]:
+        """
+        Find similar documents based on their stored vectors
+        
+        Args:
+            target_vector: Vector of target document (from vectorize_document)
+            document_vectors: List of (doc_id, vector) tuples
             threshold: Minimum similarity threshold
+            limit: Maximum number of results (default: all above threshold)
             
         Returns:
-            List of (doc_id, similarity_score) tuples, sorted by similarity
+            List of (doc_id, similarity_score) tuples, sorted by similarity;
+            equal scores keep the order of document_vectors
         """
-        if not document_contents:
+        if not document_vectors:
             return []
         
+        from scipy import sparse
+        from sklearn.preprocessing import normalize
+        
         try:
-            # Preprocess target document
-            target = self.preprocess_text(target_content)
+            # Target document is the first row
+            counts = sparse.vstack(
+                [_load_vector(target_vector)] +
+                [_load_vector(vector) for _, vector in document_vectors],
+                format='csr'
+            )
             
-            # Preprocess all documents
-            all_contents = [target] + [self.preprocess_text(content) for _, content in document_contents]
+            # Smoothed IDF over the compared documents, as TfidfVectorizer does
+            n_docs = counts.shape[0]
+            df = np.bincount(counts.indices, minlength=counts.shape[1])
+            idf = np.log((1 + n_docs) / (1 + df)) + 1
+            tfidf_matrix = normalize(sparse.csr_matrix(counts.multiply(idf)))
             
-            # Create TF-IDF matrix
-            tfidf_matrix = self.tfidf_vectorizer.fit_transform(all_contents)
+            # Cosine similarities with target in one sparse product
+            similarities = (tfidf_matrix[1:] @ tfidf_matrix[0].T).toarray().ravel()
             
-            # Calculate similarities with target (first document)
-            similarities = cosine_similarity(tfidf_matrix[0:1], tfidf_matrix[1:])[0]
+            keep = np.flatnonzero(similarities >= threshold)
             
-            # Create results
-            similar_docs = [
-                (doc_id, float(sim)) 
-                for (doc_id, _), sim in zip(document_contents, similarities)
-                if sim >= threshold
-            ]
+            # Partial selection of the top `limit` scores instead of sorting
+            # everything; ties at the cut go to the earliest documents
+            if limit is not None and len(keep) > limit:
+                if limit <= 0:
+                    return []
+                scores = similarities[keep]
+                kth = np.partition(scores, len(scores) - limit)[len(scores) - limit]
+                above = keep[scores > kth]
+                ties = keep[scores == kth][:limit - len(above)]
+                keep = np.concatenate([above, ties])
             
-            # Sort by similarity (descending)
-            similar_docs.sort(key=lambda x: x[1], reverse=True)
+            # Sort by similarity (descending), then by input position
+            keep = keep[np.lexsort((keep, -similarities[keep]))]
             
-            return similar_docs
+            return [(document_vectors[i][0], float(similarities[i])) for i in keep]
             
         except Exception as e:
             logger.error(f"Error finding similar documents: {e}")
-            return []
\ No newline at end of file
+            return []
@@ -0,0 +1,219 @@
+"""
+Document ingestion for AutoTagger
+Tag extraction and storage shared by the upload route and the background
+task, and the NLP processor setup run at startup
+"""
+from flask import current_app
+from sqlalchemy import insert
+from sqlalchemy.orm import undefer
+import hashlib
+import json
+import logging
+from pathlib import Path
+
+from app import db
+from app.models import Document, Tag
+from app.nlp_processor import NLPProcessor
+
+logger = logging.getLogger(__name__)
+
+# Redis client for cached tag extraction results (lazy loading)
+_nlp_cache = None
+
+def init_nlp_processor(app):
+    """
+    Create the application's shared NLP processor at startup
+    
+    Models are loaded before the first request (and before gunicorn forks
+    workers when the app is preloaded) unless NLP_PRELOAD is off. Must be
+    called inside an application context.
+    
+    Args:
+        app: Flask application instance
+    """
+    nlp_processor = NLPProcessor(
+        max_keywords=app.config['MAX_KEYWORDS'],
+        min_keyword_length=app.config['MIN_KEYWORD_LENGTH']
+    )
+    if app.config['NLP_PRELOAD']:
+        nlp_processor.warm_up()
+    init_tfidf_vocabulary(nlp_processor)
+    backfill_document_vectors(nlp_processor)
+    app.nlp_processor = nlp_processor
+
+def init_tfidf_vocabulary(nlp_processor):
+    """
+    Fit the shared TF-IDF vocabulary over all stored documents
+    
+    Runs at startup only, never inside a request. The vocabulary is refitted
+    only once the corpus has doubled since the last fit; otherwise the
+    vectorizer pickled to UPLOAD_FOLDER/tfidf.pkl by an earlier start is reused.
+    The vocabulary only supplies IDF weights, so new terms still become keywords.
+    """
+    cache_path = Path(current_app.config['UPLOAD_FOLDER']) / 'tfidf.pkl'
+    corpus_size = Document.query.count()
+    
+    if not nlp_processor.vocabulary_is_stale(corpus_size):
+        return
+    
+    if nlp_processor.load_vectorizer(cache_path, corpus_size):
+        return
+    
+    contents = [content for (content,) in db.session.query(Document.content)]
+    if nlp_processor.fit_corpus(contents):
+        nlp_processor.save_vectorizer(cache_path, corpus_size)
+
+def backfill_document_vectors(nlp_processor):
+    """Compute similarity vectors for processed documents stored without one"""
+    documents = Document.query.options(undefer(Document.content)).filter(
+        Document.processed == True,
+        Document.tfidf_vector.is_(None)
+    ).all()
+    
+    if not documents:
+        return
+    
+    for document in documents:
+        document.tfidf_vector = nlp_processor.vectorize_document(document.content)
+    db.session.commit()
+    logger.info(f"Computed similarity vectors for {len(documents)} documents")
+
+def hash_content(content):
+    """Return the BLAKE2b hex digest identifying a document's text"""
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=16).hexdigest()
+
+def get_nlp_cache():
+    """Get the Redis client for tag extraction results, or None if disabled"""
+    global _nlp_cache
+    url = current_app.config['NLP_CACHE_URL']
+    if not url:
+        return None
+    if _nlp_cache is None:
+        import redis
+        _nlp_cache = redis.Redis.from_url(url, socket_timeout=1)
+    return _nlp_cache
+
+def extract_tags_cached(nlp_processor, content, content_hash):
+    """
+    Extract tags, reusing results cached in Redis for identical content
+    
+    Cache errors are logged and fall back to running the NLP pipeline.
+    
+    Args:
+        nlp_processor: NLPProcessor instance
+        content: Document text
+        content_hash: Digest of the text from hash_content
+    
+    Returns:
+        Dictionary of extracted keywords and entities
+    """
+    cache = get_nlp_cache()
+    if cache is None:
+        return nlp_processor.extract_all_tags(content)
+    
+    from redis.exceptions import RedisError
+    
+    key = f'nlp:{content_hash}'
+    try:
+        cached = cache.get(key)
+        if cached is not None:
+            logger.info(f"Using cached tags for content {content_hash}")
+            return json.loads(cached)
+    except RedisError as e:
+        logger.warning(f"NLP cache lookup failed: {e}")
+    
+    tags_data = nlp_processor.extract_all_tags(content)
+    
+    try:
+        cache.setex(key, current_app.config['NLP_CACHE_TTL'], json.dumps(tags_data))
+    except RedisError as e:
+        logger.warning(f"NLP cache store failed: {e}")
+    
+    return tags_data
+
+def build_tag_rows(document_id, tags_data):
+    """Turn extracted keywords and entities into tag rows for insert_tags"""
+    return [
+        {
+            'document_id': document_id,
+            'tag_name': tag_info['tag_name'],
+            'tag_type': tag_info['tag_type'],
+            'confidence_score': tag_info['confidence_score'],
+            'entity_type': tag_info.get('entity_type')
+        }
+        for tag_info in tags_data['keywords'] + tags_data['entities']
+    ]
+
+def insert_document(values):
+    """
+    Insert a document row and return it without a separate flush
+    
+    Uses INSERT ... RETURNING where the database supports it.
+    
+    Args:
+        values: Column values for the new document
+    
+    Returns:
+        Document instance with its ID
+    """
+    if db.engine.dialect.insert_returning:
+        return db.session.scalars(insert(Document).returning(Document), [values]).one()
+    
+    document = Document(**values)
+    db.session.add(document)
+    db.session.flush()
+    return document
+
+def tag_document(document):
+    """
+    Extract tags for a stored document, save them and mark it processed
+    
+    Used by the background processing task and to retry failed documents.
+    
+    Args:
+        document: Document instance with an ID and content
+    
+    Returns:
+        Dictionary of extracted keywords and entities
+    """
+    nlp_processor = current_app.nlp_processor
+    if document.content_hash is None:
+        document.content_hash = hash_content(document.content)
+    tags_data = extract_tags_cached(nlp_processor, document.content, document.content_hash)
+    
+    # Save keywords and entities to database in one statement
+    insert_tags(build_tag_rows(document.id, tags_data))
+    
+    # Store similarity vector and mark document as processed
+    document.tfidf_vector = nlp_processor.vectorize_document(document.content)
+    document.processed = True
+    db.session.commit()
+    
+    return tags_data
+
+def insert_tags(rows):
+    """
+    Insert tag rows with a single executemany
+    
+    Rows that would duplicate an existing (document_id, tag_name, tag_type)
+    are skipped on SQLite and PostgreSQL.
+    """
+    if not rows:
+        return
+    
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        dialect_insert = None
+    
+    if dialect_insert is not None:
+        stmt = dialect_insert(Tag.__table__).on_conflict_do_nothing(
+            index_elements=['document_id', 'tag_name', 'tag_type']
+        )
+    else:
+        stmt = insert(Tag.__table__)
+    
+    db.session.execute(stmt, rows)
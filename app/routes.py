@@ -3,37 +3,139 @@ REST API Routes for AutoTagger
 """
 from flask import Blueprint, request, jsonify, current_app
 from werkzeug.utils import secure_filename
-from sqlalchemy import func
+from sqlalchemy import func, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload, undefer
+import base64
+import binascii
 import logging
 import time
+from datetime import datetime
 from pathlib import Path
 
 from app import db
 from app.models import Document, Tag
-from app.nlp_processor import NLPProcessor
 from app.file_handler import FileHandler
+from app.error_handlers import validate_file_upload, validate_pagination_params
+from app.processing import (
+    build_tag_rows, extract_tags_cached, hash_content, insert_document,
+    insert_tags, tag_document
+)
+from app.tasks import process_document
 
 api_bp = Blueprint('api', __name__)
 logger = logging.getLogger(__name__)
 
-# Initialize NLP processor (lazy loading)
-_nlp_processor = None
+def encode_cursor(document):
+    """Build an opaque listing cursor pointing just after a document"""
+    position = f'{document.upload_date.isoformat()}|{document.id}'
+    return base64.urlsafe_b64encode(position.encode('utf-8')).decode('ascii')
 
-def get_nlp_processor():
-    """Get or create NLP processor instance"""
-    global _nlp_processor
-    if _nlp_processor is None:
-        _nlp_processor = NLPProcessor(
-            max_keywords=current_app.config['MAX_KEYWORDS'],
-            min_keyword_length=current_app.config['MIN_KEYWORD_LENGTH']
-        )
-    return _nlp_processor
+def decode_cursor(cursor):
+    """
+    Decode a listing cursor from encode_cursor
+    
+    Returns:
+        Tuple of (upload_date, document_id), or None if the cursor is invalid
+    """
+    try:
+        position = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        upload_date, doc_id = position.split('|')
+        return datetime.fromisoformat(upload_date), int(doc_id)
+    except (binascii.Error, UnicodeError, ValueError):
+        return None
+
+def duplicate_document_response(document):
+    """Response for an upload whose content is already stored as `document`"""
+    logger.info(f"Upload matches existing document {document.id}")
+    return jsonify({
+        'message': 'Document with identical content already exists',
+        'document': document.to_dict()
+    }), 200
+
+def processed_response(document, tags_data, start_time):
+    """
+    Response for a document whose tags were extracted during the upload
+    
+    Args:
+        document: Processed Document instance
+        tags_data: Dictionary of extracted keywords and entities
+        start_time: time.time() when the upload started
+    """
+    # Load only the first few inserted tags for the response
+    tag_total = len(tags_data['keywords']) + len(tags_data['entities'])
+    tags_preview = Tag.query.filter_by(document_id=document.id).order_by(Tag.id).limit(
+        current_app.config['UPLOAD_TAGS_PREVIEW']
+    ).all()
+    
+    processing_time = time.time() - start_time
+    
+    logger.info(f"Document {document.id} processed in {processing_time:.2f}s with {tag_total} tags")
+    
+    return jsonify({
+        'message': 'Document uploaded and processed successfully',
+        'document': document.to_dict(tag_count=tag_total),
+        'tags_preview': [tag.to_dict() for tag in tags_preview],
+        'processing_time': round(processing_time, 2),
+        'tag_summary': {
+            'keywords': len(tags_data['keywords']),
+            'entities': len(tags_data['entities']),
+            'total': tag_total
+        }
+    }), 201
+
+def processing_response(document):
+    """Response for a document whose tags are being extracted by a worker"""
+    return jsonify({
+        'message': 'Document uploaded, processing started',
+        'document_id': document.id,
+        'status': 'processing'
+    }), 202
+
+def queue_document(document):
+    """
+    Queue tag extraction for a committed document on a Celery worker
+    
+    If the task cannot be queued the document is deleted, so the same
+    content can be uploaded again instead of staying unprocessed.
+    
+    Args:
+        document: Document instance
+    
+    Returns:
+        True if the task was queued
+    """
+    try:
+        process_document.delay(document.id)
+    except Exception as e:
+        logger.error(f"Could not queue document {document.id}: {e}")
+        db.session.delete(document)
+        db.session.commit()
+        return False
+    
+    logger.info(f"Document {document.id} queued for processing")
+    return True
+
+def reprocess_document(document, start_time):
+    """Run tag extraction again for a document whose processing failed"""
+    logger.info(f"Upload matches failed document {document.id}, processing again")
+    document.processing_error = None
+    
+    if current_app.config['ASYNC_PROCESSING']:
+        db.session.commit()
+        if not queue_document(document):
+            return jsonify({'error': 'Could not queue document for processing'}), 503
+        return processing_response(document)
+    
+    tags_data = tag_document(document)
+    return processed_response(document, tags_data, start_time)
 
 def get_file_handler():
     """Get file handler instance"""
     return FileHandler(
         upload_folder=current_app.config['UPLOAD_FOLDER'],
-        allowed_extensions=current_app.config['ALLOWED_EXTENSIONS']
+        allowed_extensions=current_app.config['ALLOWED_EXTENSIONS'],
+        upload_chunk_size=current_app.config['UPLOAD_CHUNK_SIZE']
     )
 
 @api_bp.route('/documents/upload', methods=['POST'])
@@ -41,8 +143,12 @@ def upload_document():
     """
     Upload a document and automatically generate tags
     
+    Content identical to an already stored document is not processed again;
+    the existing document is returned with status 200.
+    
     Returns:
-        JSON response with document details and extracted tags
+        JSON response with document details, tag counts and the first
+        UPLOAD_TAGS_PREVIEW tags (GET /documents/<id> lists them all)
     """
     start_time = time.time()
     
@@ -53,8 +159,15 @@ def upload_document():
         
         file = request.files['file']
         
-        if file.filename == '':
-            return jsonify({'error': 'No file selected'}), 400
+        is_valid, error_message = validate_file_upload(
+            file,
+            current_app.config['ALLOWED_EXTENSIONS'],
+            max_size=current_app.config['MAX_CONTENT_LENGTH'],
+            content_length=request.content_length
+        )
+        
+        if not is_valid:
+            return jsonify({'error': error_message}), 400
         
         # Secure filename
         filename = secure_filename(file.filename)
@@ -77,78 +190,102 @@ def upload_document():
         file_size = filepath.stat().st_size
         file_type = filepath.suffix[1:].lower()
         
-        # Create document record
-        document = Document(
-            filename=filename,
-            content=content,
-            file_size=file_size,
-            file_type=file_type,
-            processed=False
-        )
-        db.session.add(document)
-        db.session.flush()  # Get document ID
-        
-        # Extract tags using NLP
-        nlp_processor = get_nlp_processor()
-        tags_data = nlp_processor.extract_all_tags(content)
-        
-        # Save tags to database
-        all_tags = []
-        
-        # Save keywords
-        for tag_info in tags_data['keywords']:
-            tag = Tag(
-                document_id=document.id,
-                tag_name=tag_info['tag_name'],
-                tag_type=tag_info['tag_type'],
-                confidence_score=tag_info['confidence_score']
-            )
-            db.session.add(tag)
-            all_tags.append(tag)
-        
-        # Save entities
-        for tag_info in tags_data['entities']:
-            tag = Tag(
-                document_id=document.id,
-                tag_name=tag_info['tag_name'],
-                tag_type=tag_info['tag_type'],
-                confidence_score=tag_info['confidence_score'],
-                entity_type=tag_info.get('entity_type')
-            )
-            db.session.add(tag)
-            all_tags.append(tag)
+        # Identical content was already uploaded, skip all processing
+        content_hash = hash_content(content)
+        existing = Document.query.filter_by(content_hash=content_hash).first()
         
-        # Mark document as processed
-        document.processed = True
+        if existing:
+            file_handler.delete_file(filepath)
+            if existing.processing_error is not None:
+                return reprocess_document(existing, start_time)
+            return duplicate_document_response(existing)
+        
+        # Hand tag extraction to a worker and return straight away
+        if current_app.config['ASYNC_PROCESSING']:
+            document = Document(
+                filename=filename,
+                content=content,
+                file_size=file_size,
+                file_type=file_type,
+                processed=False,
+                content_hash=content_hash
+            )
+            db.session.add(document)
+            db.session.commit()
+            
+            if not queue_document(document):
+                file_handler.delete_file(filepath)
+                return jsonify({'error': 'Could not queue document for processing'}), 503
+            
+            return processing_response(document)
+        
+        # Extract tags using NLP before writing anything
+        nlp_processor = current_app.nlp_processor
+        tags_data = extract_tags_cached(nlp_processor, content, content_hash)
+        
+        # Insert the processed document, then its tags, in one transaction
+        document = insert_document({
+            'filename': filename,
+            'content': content,
+            'file_size': file_size,
+            'file_type': file_type,
+            'processed': True,
+            'content_hash': content_hash,
+            'tfidf_vector': nlp_processor.vectorize_document(content)
+        })
+        insert_tags(build_tag_rows(document.id, tags_data))
         db.session.commit()
         
-        processing_time = time.time() - start_time
+        return processed_response(document, tags_data, start_time)
         
-        logger.info(f"Document {document.id} processed in {processing_time:.2f}s with {len(all_tags)} tags")
-        
-        return jsonify({
-            'message': 'Document uploaded and processed successfully',
-            'document': document.to_dict(),
-            'tags': [tag.to_dict() for tag in all_tags],
-            'processing_time': round(processing_time, 2),
-            'tag_summary': {
-                'keywords': len(tags_data['keywords']),
-                'entities': len(tags_data['entities']),
-                'total': len(all_tags)
-            }
-        }), 201
+    except IntegrityError as e:
+        # A concurrent upload of the same content committed first
+        db.session.rollback()
+        existing = Document.query.filter_by(content_hash=content_hash).first()
+        if existing:
+            file_handler.delete_file(filepath)
+            return duplicate_document_response(existing)
+        logger.error(f"Error uploading document: {e}")
+        return jsonify({'error': f'Internal server error: {str(e)}'}), 500
         
     except Exception as e:
         db.session.rollback()
         logger.error(f"Error uploading document: {e}")
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
+@api_bp.route('/documents/<int:doc_id>/status', methods=['GET'])
+def get_document_status(doc_id):
+    """
+    Get the processing status of a document
+    
+    Args:
+        doc_id: Document ID
+    
+    Returns:
+        JSON response with the document's processing status
+    """
+    document = Document.query.get_or_404(doc_id)
+    
+    if document.processed:
+        return jsonify({'document_id': document.id, 'status': 'processed'}), 200
+    
+    if document.processing_error is not None:
+        return jsonify({
+            'document_id': document.id,
+            'status': 'failed',
+            'error': document.processing_error
+        }), 200
+    
+    return jsonify({'document_id': document.id, 'status': 'processing'}), 200
+
 @api_bp.route('/documents', methods=['GET'])
 def get_documents():
     """
     Get all documents with their tags
     
     Query parameters:
+        - cursor: next_cursor from a previous response; replaces page and
+          stays fast however deep the listing goes
         - page: Page number (default: 1)
         - per_page: Results per page (default: 20)
         - processed: Filter by processing status (true/false)
@@ -157,35 +294,72 @@ def get_documents():
         JSON response with list of documents
     """
     try:
+        cursor = request.args.get('cursor', type=str)
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', current_app.config['RESULTS_PER_PAGE'], type=int)
-        processed_filter = request.args.get('processed', type=str)
+        processed_filter = request.args.get(
+            'processed', type=lambda value: value.lower() in ('1', 'true', 'yes')
+        )
+        
+        is_valid, error_message = validate_pagination_params(page, per_page)
+        if not is_valid:
+            return jsonify({'error': error_message}), 400
         
         # Build query
         query = Document.query
         
-        if processed_filter:
-            query = query.filter_by(processed=(processed_filter.lower() == 'true'))
+        if processed_filter is not None:
+            query = query.filter_by(processed=processed_filter)
+        
+        query = query.order_by(Document.upload_date.desc(), Document.id.desc())
+        
+        if cursor:
+            # Keyset pagination: continue after the cursor's (upload_date, id)
+            position = decode_cursor(cursor)
+            if position is None:
+                return jsonify({'error': 'Invalid cursor'}), 400
+            
+            items = query.filter(
+                tuple_(Document.upload_date, Document.id) < position
+            ).limit(per_page + 1).all()
+            has_next = len(items) > per_page
+            items = items[:per_page]
+            pagination_info = {'per_page': per_page}
+        else:
+            # Paginate
+            pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+            items = pagination.items
+            has_next = pagination.has_next
+            pagination_info = {
+                'page': pagination.page,
+                'per_page': pagination.per_page,
+                'total_pages': pagination.pages,
+                'total_documents': pagination.total
+            }
         
-        # Paginate
-        pagination = query.order_by(Document.upload_date.desc()).paginate(
-            page=page, per_page=per_page, error_out=False
-        )
+        pagination_info['next_cursor'] = encode_cursor(items[-1]) if has_next else None
+        
+        # Load tags of the whole page in one query, as plain rows
+        tags_by_doc = {}
+        if items:
+            tag_rows = db.session.query(
+                *(getattr(Tag, column) for column in Tag.DICT_COLUMNS)
+            ).filter(
+                Tag.document_id.in_([doc.id for doc in items])
+            ).order_by(Tag.id)
+            for row in tag_rows:
+                tags_by_doc.setdefault(row.document_id, []).append(Tag.row_to_dict(row))
         
         documents = []
-        for doc in pagination.items:
-            doc_dict = doc.to_dict()
-            doc_dict['tags'] = [tag.to_dict() for tag in doc.tags.all()]
+        for doc in items:
+            doc_tags = tags_by_doc.get(doc.id, [])
+            doc_dict = doc.to_dict(tag_count=len(doc_tags))
+            doc_dict['tags'] = doc_tags
             documents.append(doc_dict)
         
         return jsonify({
             'documents': documents,
-            'pagination': {
-                'page': pagination.page,
-                'per_page': pagination.per_page,
-                'total_pages': pagination.pages,
-                'total_documents': pagination.total
-            }
+            'pagination': pagination_info
         }), 200
         
     except Exception as e:
@@ -206,19 +380,27 @@ def get_document(doc_id):
     Returns:
         JSON response with document details
     """
+    include_content = request.args.get('include_content', 'false').lower() == 'true'
+    
+    query = Document.query
+    if include_content:
+        query = query.options(undefer(Document.content))
+    document = query.get_or_404(doc_id)
+    
     try:
-        document = Document.query.get_or_404(doc_id)
-        
-        include_content = request.args.get('include_content', 'false').lower() == 'true'
-        
-        doc_dict = document.to_dict(include_content=include_content)
-        doc_dict['tags'] = [tag.to_dict() for tag in document.tags.all()]
+        tags = [tag.to_dict() for tag in document.tags_list]
+        doc_dict = document.to_dict(include_content=include_content, tag_count=len(tags))
+        doc_dict['tags'] = tags
         
         # Group tags by type
+        tags_by_type = {'keyword': [], 'entity': [], 'custom': []}
+        for tag in tags:
+            tags_by_type.setdefault(tag['tag_type'], []).append(tag)
+        
         doc_dict['tags_by_type'] = {
-            'keywords': [tag.to_dict() for tag in document.tags.filter_by(tag_type='keyword').all()],
-            'entities': [tag.to_dict() for tag in document.tags.filter_by(tag_type='entity').all()],
-            'custom': [tag.to_dict() for tag in document.tags.filter_by(tag_type='custom').all()]
+            'keywords': tags_by_type['keyword'],
+            'entities': tags_by_type['entity'],
+            'custom': tags_by_type['custom']
         }
         
         return jsonify(doc_dict), 200
@@ -244,39 +426,49 @@ def update_document_tags(doc_id):
     Returns:
         JSON response with updated tags
     """
+    document = Document.query.get_or_404(doc_id)
+    
     try:
-        document = Document.query.get_or_404(doc_id)
         data = request.get_json()
         
         if not data:
             return jsonify({'error': 'No data provided'}), 400
         
-        # Add new tags
+        # Remove tags (first, so removed tags can be re-added)
+        removed_count = 0
+        if 'remove_tag_ids' in data:
+            for tag_id in data['remove_tag_ids']:
+                tag = Tag.query.filter_by(id=tag_id, document_id=doc_id).first()
+                if tag:
+                    db.session.delete(tag)
+                    removed_count += 1
+            db.session.flush()
+        
+        # Add new tags, skipping ones the document already has
         added_tags = []
         if 'add_tags' in data:
+            existing = set(
+                db.session.query(Tag.tag_name, Tag.tag_type).filter_by(document_id=doc_id).all()
+            )
             for tag_data in data['add_tags']:
                 if 'tag_name' not in tag_data:
                     continue
                 
+                key = (tag_data['tag_name'], tag_data.get('tag_type', 'custom'))
+                if key in existing:
+                    continue
+                existing.add(key)
+                
                 tag = Tag(
                     document_id=doc_id,
-                    tag_name=tag_data['tag_name'],
-                    tag_type=tag_data.get('tag_type', 'custom'),
+                    tag_name=key[0],
+                    tag_type=key[1],
                     confidence_score=tag_data.get('confidence_score', 1.0),
                     entity_type=tag_data.get('entity_type')
                 )
                 db.session.add(tag)
                 added_tags.append(tag)
         
-        # Remove tags
-        removed_count = 0
-        if 'remove_tag_ids' in data:
-            for tag_id in data['remove_tag_ids']:
-                tag = Tag.query.filter_by(id=tag_id, document_id=doc_id).first()
-                if tag:
-                    db.session.delete(tag)
-                    removed_count += 1
-        
         db.session.commit()
         
         return jsonify({
@@ -302,9 +494,9 @@ def delete_document(doc_id):
     Returns:
         JSON response confirming deletion
     """
+    document = Document.query.get_or_404(doc_id)
+    
     try:
-        document = Document.query.get_or_404(doc_id)
-        
         # Delete associated file if it exists
         file_handler = get_file_handler()
         filepath = Path(current_app.config['UPLOAD_FOLDER']) / document.filename
@@ -330,6 +522,9 @@ def find_similar_documents(doc_id):
     """
     Find similar documents based on content
     
+    Only documents sharing at least SIMILARITY_MIN_TAG_OVERLAP tags with
+    the source document are scored, up to SIMILARITY_CANDIDATE_LIMIT.
+    
     Args:
         doc_id: Document ID
     
@@ -340,47 +535,70 @@ def find_similar_documents(doc_id):
     Returns:
         JSON response with similar documents
     """
+    document = Document.query.options(undefer(Document.tfidf_vector)).get_or_404(doc_id)
+    
     try:
-        document = Document.query.get_or_404(doc_id)
-        
         limit = request.args.get('limit', 5, type=int)
         threshold = request.args.get('threshold', 
                                     current_app.config['SIMILARITY_THRESHOLD'], 
                                     type=float)
         
-        # Get all other documents
-        other_documents = Document.query.filter(
+        # Narrow the comparison set to documents sharing tags with this one
+        source_tags = [
+            tag_name for (tag_name,) in
+            db.session.query(Tag.tag_name).filter(Tag.document_id == doc_id).distinct()
+        ]
+        
+        vector_query = db.session.query(Document.id, Document.tfidf_vector).filter(
             Document.id != doc_id,
-            Document.processed == True
-        ).all()
+            Document.processed == True,
+            Document.tfidf_vector.isnot(None)
+        )
         
-        if not other_documents:
+        if source_tags:
+            overlap = func.count(func.distinct(Tag.tag_name))
+            candidates = db.session.query(Tag.document_id).filter(
+                Tag.tag_name.in_(source_tags),
+                Tag.document_id != doc_id
+            ).group_by(Tag.document_id).having(
+                overlap >= current_app.config['SIMILARITY_MIN_TAG_OVERLAP']
+            ).order_by(
+                overlap.desc(), Tag.document_id
+            ).limit(current_app.config['SIMILARITY_CANDIDATE_LIMIT']).cte('candidates')
+            vector_query = vector_query.join(candidates, candidates.c.document_id == Document.id)
+        
+        # Get stored vectors of the candidate documents
+        document_vectors = vector_query.all()
+        
+        if not document_vectors:
             return jsonify({
                 'message': 'No other documents to compare',
                 'similar_documents': []
             }), 200
         
-        # Prepare document contents
-        document_contents = [(doc.id, doc.content) for doc in other_documents]
-        
         # Find similar documents
-        nlp_processor = get_nlp_processor()
+        nlp_processor = current_app.nlp_processor
+        target_vector = document.tfidf_vector or nlp_processor.vectorize_document(document.content)
         similar_docs = nlp_processor.find_similar_documents(
-            document.content,
-            document_contents,
-            threshold=threshold
+            target_vector,
+            document_vectors,
+            threshold=threshold,
+            limit=limit
         )
         
-        # Limit results
-        similar_docs = similar_docs[:limit]
+        # Get document details in one query, keeping similarity order
+        sim_doc_ids = [sim_doc_id for sim_doc_id, _ in similar_docs]
+        sim_docs = Document.query.options(selectinload(Document.tags_list)).filter(
+            Document.id.in_(sim_doc_ids)
+        ).all()
+        sim_docs_by_id = {sim_doc.id: sim_doc for sim_doc in sim_docs}
         
-        # Get document details
         similar_documents = []
         for sim_doc_id, similarity in similar_docs:
-            sim_doc = Document.query.get(sim_doc_id)
-            doc_dict = sim_doc.to_dict()
+            sim_doc = sim_docs_by_id[sim_doc_id]
+            doc_dict = sim_doc.to_dict(tag_count=len(sim_doc.tags_list))
             doc_dict['similarity_score'] = round(similarity, 3)
-            doc_dict['tags'] = [tag.to_dict() for tag in sim_doc.tags.limit(5).all()]
+            doc_dict['tags'] = [tag.to_dict() for tag in sim_doc.tags_list[:5]]
             similar_documents.append(doc_dict)
         
         return jsonify({
@@ -404,7 +622,8 @@ def get_all_tags():
         - limit: Maximum number of tags to return (default: 100)
     
     Returns:
-        JSON response with tag statistics
+        JSON response with tag statistics; the per-type summary covers
+        the filtered tags returned, not the whole table
     """
     try:
         tag_type = request.args.get('tag_type', type=str)
@@ -429,29 +648,16 @@ def get_all_tags():
         results = query.all()
         
         tags = [
-            {
-                'tag_name': tag_name,
-                'tag_type': tag_type,
-                'document_count': document_count,
-                'avg_confidence': round(avg_confidence, 3)
-            }
-            for tag_name, tag_type, document_count, avg_confidence in results
+            {**row._mapping, 'avg_confidence': round(row.avg_confidence, 3)}
+            for row in results
         ]
         
-        # Get tag type summary
-        type_summary = db.session.query(
-            Tag.tag_type,
-            func.count(func.distinct(Tag.tag_name)).label('unique_tags'),
-            func.count(Tag.id).label('total_instances')
-        ).group_by(Tag.tag_type).all()
-        
-        summary = {
-            tag_type: {
-                'unique_tags': unique_tags,
-                'total_instances': total_instances
-            }
-            for tag_type, unique_tags, total_instances in type_summary
-        }
+        # Summarise the returned tags by type
+        summary = {}
+        for tag in tags:
+            type_stats = summary.setdefault(tag['tag_type'], {'unique_tags': 0, 'total_instances': 0})
+            type_stats['unique_tags'] += 1
+            type_stats['total_instances'] += tag['document_count']
         
         return jsonify({
             'tags': tags,
@@ -0,0 +1,72 @@
+"""
+Background tasks for AutoTagger
+Runs NLP tag extraction on a Celery worker when ASYNC_PROCESSING is enabled
+"""
+from celery import Celery, Task, shared_task
+import logging
+
+from sqlalchemy.orm import undefer
+
+from app import db
+from app.models import Document
+from app.processing import tag_document
+
+logger = logging.getLogger(__name__)
+
+def celery_init_app(app):
+    """
+    Create a Celery app whose tasks run inside the Flask application context
+    
+    Args:
+        app: Flask application instance
+    
+    Returns:
+        Celery application instance
+    """
+    class FlaskTask(Task):
+        def __call__(self, *args, **kwargs):
+            with app.app_context():
+                return self.run(*args, **kwargs)
+    
+    celery_app = Celery(app.name, task_cls=FlaskTask)
+    celery_app.config_from_object(app.config['CELERY'])
+    celery_app.set_default()
+    app.extensions['celery'] = celery_app
+    return celery_app
+
+@shared_task(bind=True, ignore_result=True, max_retries=3, default_retry_delay=30)
+def process_document(self, doc_id):
+    """
+    Extract and store tags for an uploaded document
+    
+    Failures are retried a few times; after the last attempt the error is
+    stored on the document so its status reports 'failed'.
+    
+    Args:
+        doc_id: Document ID
+    """
+    document = db.session.get(Document, doc_id, options=[undefer(Document.content)])
+    
+    if document is None:
+        logger.warning(f"Document {doc_id} no longer exists, skipping processing")
+        return
+    
+    if document.processed:
+        return
+    
+    try:
+        tags_data = tag_document(document)
+        logger.info(
+            f"Document {doc_id} processed with "
+            f"{len(tags_data['keywords']) + len(tags_data['entities'])} tags"
+        )
+    except Exception as e:
+        db.session.rollback()
+        
+        if self.request.retries < self.max_retries:
+            logger.warning(f"Processing document {doc_id} failed, retrying: {e}")
+            raise self.retry(exc=e)
+        
+        logger.error(f"Error processing document {doc_id}: {e}")
+        document.processing_error = str(e)[:255]
+        db.session.commit()
@@ -0,0 +1,14 @@
+"""
+AutoTagger Celery Worker Entry Point
+Start a worker with: celery -A celery_worker worker --loglevel=info
+"""
+import os
+from app import create_app
+
+# Get configuration from environment or use production defaults
+config_name = os.getenv('FLASK_ENV', 'production')
+
+# The Flask app provides configuration and the database for tasks. It is
+# not named `app`: celery -A looks for that attribute before `celery_app`
+flask_app = create_app(config_name)
+celery_app = flask_app.extensions['celery']
@@ -7,6 +7,24 @@ from pathlib import Path
 # Base directory
 BASE_DIR = Path(__file__).parent.absolute()
 
+def _engine_options(database_uri):
+    """
+    SQLAlchemy engine options for a database URI
+    
+    Server databases get a larger connection pool that checks connections
+    before use and recycles them before servers drop idle ones. SQLite keeps
+    SQLAlchemy's defaults (Flask-SQLAlchemy already configures in-memory
+    databases for sharing across threads).
+    """
+    if database_uri.startswith('sqlite'):
+        return {}
+    return {
+        'pool_size': 20,
+        'max_overflow': 40,
+        'pool_pre_ping': True,
+        'pool_recycle': 1800
+    }
+
 # Flask Configuration
 class Config:
     """Base configuration"""
@@ -15,24 +33,43 @@ class Config:
     # Database
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', f'sqlite:///{BASE_DIR}/autotagger.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ENGINE_OPTIONS = _engine_options(SQLALCHEMY_DATABASE_URI)
     
     # File Upload Settings
     UPLOAD_FOLDER = BASE_DIR / 'uploads'
     MAX_CONTENT_LENGTH = 10 * 1024 * 1024  # 10MB max file size
     ALLOWED_EXTENSIONS = {'txt', 'pdf'}
+    UPLOAD_CHUNK_SIZE = 1024 * 1024  # Bytes per read when streaming uploads to disk
     
     # NLP Settings
     NLP_MODEL = 'en_core_web_sm'
+    NLP_PRELOAD = True  # Load NLP models at startup instead of on first use
     MAX_KEYWORDS = 10
     MIN_KEYWORD_LENGTH = 3
+    NLP_CACHE_URL = os.environ.get('NLP_CACHE_URL')  # Redis URL for cached tag extraction (off if unset)
+    NLP_CACHE_TTL = 86400  # Seconds cached tag extraction results are kept
     SIMILARITY_THRESHOLD = 0.3  # Minimum similarity score to consider documents related
+    SIMILARITY_CANDIDATE_LIMIT = 200  # Max documents scored per similarity query
+    SIMILARITY_MIN_TAG_OVERLAP = 1  # Shared tags required to be a similarity candidate
+    
+    # Background processing
+    # Extract tags on a Celery worker instead of in the request (needs Redis and a worker)
+    ASYNC_PROCESSING = os.environ.get('ASYNC_PROCESSING', '').lower() in ('1', 'true', 'yes')
+    REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+    CELERY = {
+        'broker_url': REDIS_URL,
+        'task_ignore_result': True
+    }
     
     # Logging
     LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
     LOG_FILE = BASE_DIR / 'logs' / 'autotagger.log'
+    LOG_BUFFER_CAPACITY = int(os.environ.get('LOG_BUFFER', 1024))  # Records buffered before a write
+    LOG_FLUSH_INTERVAL = 5  # Seconds between background flushes
     
     # API Settings
     RESULTS_PER_PAGE = 20
+    UPLOAD_TAGS_PREVIEW = 10  # Tags included in the upload response
 
 class DevelopmentConfig(Config):
     """Development configuration"""
@@ -48,6 +85,8 @@ class TestingConfig(Config):
     """Testing configuration"""
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    SQLALCHEMY_ENGINE_OPTIONS = _engine_options(SQLALCHEMY_DATABASE_URI)
+    NLP_PRELOAD = False
 
 # Configuration dictionary
 config = {
@@ -4,6 +4,7 @@ Demonstrates how to interact with the API endpoints
 """
 import requests
 import json
+import time
 from pathlib import Path
 
 # Base API URL
@@ -40,14 +41,44 @@ def upload_document(filepath):
         print(f"  - Processing time: {data['processing_time']}s")
         
         print(f"\n  Top tags:")
-        for tag in data['tags'][:5]:
+        for tag in data['tags_preview'][:5]:
             print(f"    - {tag['tag_name']} ({tag['tag_type']}, confidence: {tag['confidence_score']:.3f})")
         
         return data['document']['id']
+    elif response.status_code == 200:
+        data = response.json()
+        print(f"✓ {data['message']}")
+        print(f"  - Document ID: {data['document']['id']}")
+        return data['document']['id']
+    elif response.status_code == 202:
+        data = response.json()
+        print(f"✓ Document uploaded, waiting for processing...")
+        print(f"  - Document ID: {data['document_id']}")
+        return wait_for_processing(data['document_id'])
     else:
         print(f"✗ Error: {response.json()}")
         return None
 
+def wait_for_processing(doc_id, timeout=60):
+    """Poll the status of a document queued for background processing"""
+    deadline = time.time() + timeout
+    
+    while time.time() < deadline:
+        response = requests.get(f"{BASE_URL}/documents/{doc_id}/status")
+        data = response.json()
+        
+        if data['status'] == 'processed':
+            print(f"✓ Document processed")
+            return doc_id
+        if data['status'] == 'failed':
+            print(f"✗ Processing failed: {data['error']}")
+            return None
+        
+        time.sleep(1)
+    
+    print(f"✗ Document still processing after {timeout}s")
+    return None
+
 def get_all_documents():
     """Get all documents"""
     print(f"\n2. Fetching all documents")
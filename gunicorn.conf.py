@@ -0,0 +1,28 @@
+"""
+Gunicorn configuration for AutoTagger
+Start the server with: gunicorn -c gunicorn.conf.py wsgi:app
+"""
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+
+# Process count x threads per process; requests wait on the database and
+# file I/O, and tag extraction runs on Celery workers if ASYNC_PROCESSING is set
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+
+# Load the app (and NLP models) once in the master; workers share it copy-on-write
+preload_app = True
+
+timeout = 120
+
+def post_fork(server, worker):
+    """Drop database connections inherited from the master process"""
+    from app import db
+    
+    # The application gunicorn loaded, whichever module it came from
+    app = server.app.wsgi()
+    with app.app_context():
+        db.engine.dispose(close=False)
@@ -1,6 +1,6 @@
 """
-AutoTagger Application Entry Point
-Run this file to start the Flask development server
+AutoTagger Development Entry Point
+Run this file to start the Flask development server (use wsgi.py in production)
 """
 import os
 from app import create_app
@@ -4,10 +4,14 @@ Basic API tests for AutoTagger
 import pytest
 import json
 import io
+import sqlite3
 from pathlib import Path
+from sqlalchemy import event, inspect
 
 from app import create_app, db
+from app.file_handler import FileHandler
 from app.models import Document, Tag
+from config import TestingConfig
 
 @pytest.fixture
 def app():
@@ -59,9 +63,26 @@ def test_upload_document(client, sample_text):
     assert response.status_code == 201
     data = json.loads(response.data)
     assert 'document' in data
-    assert 'tags' in data
+    assert 'tags_preview' in data
     assert data['document']['processed'] is True
-    assert len(data['tags']) > 0
+    assert data['tag_summary']['total'] > 0
+
+def test_upload_duplicate_document(client, sample_text):
+    """Test uploading identical content twice"""
+    responses = [
+        client.post(
+            '/api/documents/upload',
+            data={'file': (io.BytesIO(sample_text.encode('utf-8')), name)},
+            content_type='multipart/form-data'
+        )
+        for name in ('test.txt', 'copy.txt')
+    ]
+    
+    assert responses[0].status_code == 201
+    assert responses[1].status_code == 200
+    first, second = (json.loads(response.data) for response in responses)
+    assert second['document']['id'] == first['document']['id']
+    assert Document.query.count() == 1
 
 def test_get_documents(client, sample_text):
     """Test getting all documents"""
@@ -78,6 +99,83 @@ def test_get_documents(client, sample_text):
     assert 'documents' in data
     assert len(data['documents']) > 0
 
+def test_get_documents_processed_filter(app, client):
+    """Test filtering documents by processing status"""
+    db.session.add(Document(filename='done.txt', content='text', processed=True))
+    db.session.add(Document(filename='pending.txt', content='text', processed=False))
+    db.session.commit()
+    
+    for value, filename in [('false', 'pending.txt'), ('0', 'pending.txt'), ('true', 'done.txt'), ('yes', 'done.txt')]:
+        response = client.get(f'/api/documents?processed={value}')
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert [doc['filename'] for doc in data['documents']] == [filename]
+
+def test_get_documents_cursor(app, client):
+    """Test paging through documents with cursors"""
+    for i in range(5):
+        db.session.add(Document(filename=f'doc{i}.txt', content='text', processed=True))
+    db.session.commit()
+    
+    response = client.get('/api/documents?per_page=2')
+    data = json.loads(response.data)
+    filenames = [doc['filename'] for doc in data['documents']]
+    
+    while data['pagination']['next_cursor']:
+        response = client.get(f"/api/documents?per_page=2&cursor={data['pagination']['next_cursor']}")
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        filenames.extend(doc['filename'] for doc in data['documents'])
+    
+    assert sorted(filenames) == [f'doc{i}.txt' for i in range(5)]
+    
+    response = client.get('/api/documents?cursor=not-a-cursor')
+    assert response.status_code == 400
+
+def test_get_documents_invalid_per_page(app, client):
+    """Test per_page values outside 1-100 are rejected, with or without a cursor"""
+    for i in range(3):
+        db.session.add(Document(filename=f'doc{i}.txt', content='text', processed=True))
+    db.session.commit()
+    
+    response = client.get('/api/documents?per_page=1')
+    cursor = json.loads(response.data)['pagination']['next_cursor']
+    
+    for per_page in (0, -1, 101):
+        response = client.get(f'/api/documents?per_page={per_page}&cursor={cursor}')
+        assert response.status_code == 400
+        response = client.get(f'/api/documents?per_page={per_page}')
+        assert response.status_code == 400
+
+def test_get_documents_query_count(app, client):
+    """Test that listing documents doesn't issue a query per document"""
+    def add_documents(count):
+        for i in range(count):
+            document = Document(filename=f'doc{i}.txt', content='text', processed=True)
+            db.session.add(document)
+            db.session.flush()
+            db.session.add(Tag(document_id=document.id, tag_name=f'tag{i}', tag_type='keyword'))
+        db.session.commit()
+    
+    def count_queries():
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        response = client.get('/api/documents')
+        event.remove(db.engine, 'before_cursor_execute', listener)
+        assert response.status_code == 200
+        return len(statements), json.loads(response.data)
+    
+    add_documents(1)
+    single_count, _ = count_queries()
+    
+    add_documents(5)
+    many_count, data = count_queries()
+    
+    assert len(data['documents']) == 6
+    assert all(len(doc['tags']) == doc['tag_count'] == 1 for doc in data['documents'])
+    assert many_count == single_count
+
 def test_get_specific_document(client, sample_text):
     """Test getting specific document"""
     # Upload a document
@@ -97,6 +195,13 @@ def test_get_specific_document(client, sample_text):
     data = json.loads(response.data)
     assert data['id'] == doc_id
     assert 'tags' in data
+    assert len(data['tags_by_type']['keywords']) == sum(
+        1 for tag in data['tags'] if tag['tag_type'] == 'keyword'
+    )
+    assert 'content' not in data
+    
+    response = client.get(f'/api/documents/{doc_id}?include_content=true')
+    assert 'Machine learning' in json.loads(response.data)['content']
 
 def test_update_tags(client, sample_text):
     """Test updating document tags"""
@@ -128,6 +233,17 @@ def test_update_tags(client, sample_text):
     assert response.status_code == 200
     data = json.loads(response.data)
     assert data['added'] == 2
+    
+    # Adding the same tags again is a no-op
+    response = client.put(
+        f'/api/documents/{doc_id}/tags',
+        data=json.dumps(update_data),
+        content_type='application/json'
+    )
+    
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['added'] == 0
 
 def test_delete_document(client, sample_text):
     """Test deleting document"""
@@ -182,4 +298,247 @@ def test_invalid_file_type(client):
 def test_no_file_uploaded(client):
     """Test upload without file"""
     response = client.post('/api/documents/upload')
-    assert response.status_code == 400
\ No newline at end of file
+    assert response.status_code == 400
+
+def test_find_similar_documents(client, sample_text):
+    """Test finding similar documents"""
+    # Upload two related documents and an unrelated one
+    upload_ids = []
+    for text, name in [
+        (sample_text, 'test.txt'),
+        (sample_text + ' Deep learning models need large datasets.', 'related.txt'),
+        ('Tomato pasta recipes with garlic and fresh basil.', 'recipes.txt')
+    ]:
+        data = {'file': (io.BytesIO(text.encode('utf-8')), name)}
+        response = client.post('/api/documents/upload', data=data, content_type='multipart/form-data')
+        upload_ids.append(json.loads(response.data)['document']['id'])
+    
+    response = client.get(f'/api/documents/{upload_ids[0]}/similar')
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    similar_ids = [doc['id'] for doc in data['similar_documents']]
+    assert similar_ids == [upload_ids[1]]
+
+def test_empty_file(client):
+    """Test uploading an empty file"""
+    data = {
+        'file': (io.BytesIO(b''), 'empty.txt')
+    }
+    
+    response = client.post(
+        '/api/documents/upload',
+        data=data,
+        content_type='multipart/form-data'
+    )
+    
+    assert response.status_code == 400
+    assert json.loads(response.data)['error'] == 'File is empty'
+
+def test_async_upload_status(app, client, sample_text):
+    """Test queued upload processing and status polling"""
+    app.config['ASYNC_PROCESSING'] = True
+    app.extensions['celery'].conf.task_always_eager = True
+    
+    data = {'file': (io.BytesIO(sample_text.encode('utf-8')), 'test.txt')}
+    response = client.post('/api/documents/upload', data=data, content_type='multipart/form-data')
+    
+    assert response.status_code == 202
+    data = json.loads(response.data)
+    assert data['status'] == 'processing'
+    
+    response = client.get(f"/api/documents/{data['document_id']}/status")
+    assert response.status_code == 200
+    assert json.loads(response.data)['status'] == 'processed'
+
+def test_async_upload_failure(app, client, sample_text, monkeypatch):
+    """Test failed processing is reported and retried by uploading again"""
+    app.config['ASYNC_PROCESSING'] = True
+    app.extensions['celery'].conf.task_always_eager = True
+    
+    def fail(document):
+        raise RuntimeError('NLP model unavailable')
+    
+    monkeypatch.setattr('app.tasks.tag_document', fail)
+    
+    data = {'file': (io.BytesIO(sample_text.encode('utf-8')), 'test.txt')}
+    response = client.post('/api/documents/upload', data=data, content_type='multipart/form-data')
+    assert response.status_code == 202
+    doc_id = json.loads(response.data)['document_id']
+    
+    # The eager task committed in its own session; the test's session is shared by requests
+    db.session.expire_all()
+    
+    response = client.get(f'/api/documents/{doc_id}/status')
+    data = json.loads(response.data)
+    assert data['status'] == 'failed'
+    assert data['error'] == 'NLP model unavailable'
+    
+    monkeypatch.undo()
+    
+    data = {'file': (io.BytesIO(sample_text.encode('utf-8')), 'test.txt')}
+    response = client.post('/api/documents/upload', data=data, content_type='multipart/form-data')
+    assert response.status_code == 202
+    assert json.loads(response.data)['document_id'] == doc_id
+    
+    db.session.expire_all()
+    response = client.get(f'/api/documents/{doc_id}/status')
+    assert json.loads(response.data)['status'] == 'processed'
+
+def test_async_upload_queue_error(app, client, sample_text, monkeypatch):
+    """Test an upload that cannot be queued is not left behind"""
+    app.config['ASYNC_PROCESSING'] = True
+    
+    def fail(*args, **kwargs):
+        raise ConnectionError('broker unavailable')
+    
+    monkeypatch.setattr('app.tasks.process_document.delay', fail)
+    
+    data = {'file': (io.BytesIO(sample_text.encode('utf-8')), 'unqueued.txt')}
+    response = client.post('/api/documents/upload', data=data, content_type='multipart/form-data')
+    
+    assert response.status_code == 503
+    assert Document.query.count() == 0
+    assert not (Path(app.config['UPLOAD_FOLDER']) / 'unqueued.txt').exists()
+
+def test_upgrade_baseline_schema(tmp_path, monkeypatch, sample_text):
+    """Test the app starts on a database created by an earlier version"""
+    db_path = tmp_path / 'baseline.db'
+    connection = sqlite3.connect(db_path)
+    connection.executescript("""
+        CREATE TABLE documents (
+            id INTEGER NOT NULL PRIMARY KEY,
+            filename VARCHAR(255) NOT NULL,
+            content TEXT NOT NULL,
+            upload_date DATETIME NOT NULL,
+            processed BOOLEAN NOT NULL,
+            file_size INTEGER,
+            file_type VARCHAR(10)
+        );
+        CREATE INDEX idx_upload_date ON documents (upload_date);
+        CREATE INDEX idx_processed ON documents (processed);
+        CREATE TABLE tags (
+            id INTEGER NOT NULL PRIMARY KEY,
+            document_id INTEGER NOT NULL REFERENCES documents (id) ON DELETE CASCADE,
+            tag_name VARCHAR(100) NOT NULL,
+            tag_type VARCHAR(20) NOT NULL,
+            confidence_score FLOAT,
+            entity_type VARCHAR(50),
+            created_at DATETIME
+        );
+        CREATE INDEX idx_document_id ON tags (document_id);
+        INSERT INTO documents VALUES (1, 'old.txt', 'Old document text', '2024-01-01 00:00:00', 1, 17, 'txt');
+        INSERT INTO tags VALUES (1, 1, 'document', 'keyword', 0.5, NULL, '2024-01-01 00:00:00');
+        INSERT INTO tags VALUES (2, 1, 'document', 'keyword', 0.5, NULL, '2024-01-01 00:00:00');
+    """)
+    connection.close()
+    
+    monkeypatch.setattr(TestingConfig, 'SQLALCHEMY_DATABASE_URI', f'sqlite:///{db_path}')
+    app = create_app('testing')
+    
+    with app.app_context():
+        indexes = {index['name'] for index in inspect(db.engine).get_indexes('tags')}
+        assert 'uq_doc_tag' in indexes
+        assert 'idx_document_id' not in indexes
+        assert Tag.query.count() == 1
+        assert db.session.get(Document, 1).tfidf_vector is not None
+        
+        client = app.test_client()
+        data = {'file': (io.BytesIO(sample_text.encode('utf-8')), 'test.txt')}
+        response = client.post('/api/documents/upload', data=data, content_type='multipart/form-data')
+        assert response.status_code == 201
+        
+        db.session.remove()
+        db.engine.dispose()
+
+def test_keywords_for_unseen_terms_after_restart(tmp_path, monkeypatch, sample_text):
+    """Test documents unrelated to the startup corpus still get their own keywords"""
+    monkeypatch.setattr(TestingConfig, 'SQLALCHEMY_DATABASE_URI', f"sqlite:///{tmp_path / 'corpus.db'}")
+    monkeypatch.setattr(TestingConfig, 'UPLOAD_FOLDER', tmp_path / 'uploads')
+    
+    app = create_app('testing')
+    with app.app_context():
+        data = {'file': (io.BytesIO(sample_text.encode('utf-8')), 'test.txt')}
+        response = app.test_client().post('/api/documents/upload', data=data, content_type='multipart/form-data')
+        assert response.status_code == 201
+        db.session.remove()
+        db.engine.dispose()
+    
+    # Restart: the vocabulary is fitted on the machine learning document only
+    app = create_app('testing')
+    recipe = """
+    Learning to cook pasta. Boil the pasta in salted water. Fry the garlic in olive oil, add chopped
+    basil and tomatoes, then toss the pasta with the garlic sauce and basil.
+    """
+    with app.app_context():
+        data = {'file': (io.BytesIO(recipe.encode('utf-8')), 'recipe.txt')}
+        response = app.test_client().post('/api/documents/upload', data=data, content_type='multipart/form-data')
+        assert response.status_code == 201
+        
+        document_id = json.loads(response.data)['document']['id']
+        keywords = [
+            tag.tag_name
+            for tag in Tag.query.filter_by(document_id=document_id, tag_type='keyword')
+        ]
+        assert len(keywords) == 10
+        assert {'pasta', 'garlic', 'basil'} <= set(keywords)
+        db.session.remove()
+        db.engine.dispose()
+
+class FakePage:
+    """Stand-in for a PyPDF2 or pdfplumber page"""
+    
+    def __init__(self, text):
+        self.text = text
+    
+    def extract_text(self):
+        return self.text
+    
+    def flush_cache(self):
+        pass
+
+class FakePdf:
+    """Stand-in for an open pdfplumber document"""
+    
+    def __init__(self, texts):
+        self.pages = [FakePage(text) for text in texts]
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        return False
+
+def test_pdf_pages_in_order_when_pypdf2_fails(tmp_path, monkeypatch):
+    """Test pdfplumber text is joined in page order when PyPDF2 can't parse the file"""
+    def fail(*args, **kwargs):
+        raise ValueError('broken xref table')
+    
+    texts = [f'page{i}' for i in range(10)]
+    monkeypatch.setattr('app.file_handler.PyPDF2.PdfReader', fail)
+    monkeypatch.setattr('app.file_handler.pdfplumber.open', lambda path: FakePdf(texts))
+    
+    filepath = tmp_path / 'doc.pdf'
+    filepath.write_bytes(b'%PDF-1.4')
+    handler = FileHandler(tmp_path, {'pdf'})
+    
+    success, _, content = handler.extract_text_from_pdf(filepath)
+    assert success
+    assert content == '\n'.join(texts)
+
+def test_pdf_empty_pages_recovered_in_order(tmp_path, monkeypatch):
+    """Test pages PyPDF2 returns no text for are filled in from pdfplumber"""
+    class FakeReader:
+        def __init__(self, *args, **kwargs):
+            self.pages = [FakePage(text) for text in ['page0', '', 'page2', '', 'page4']]
+    
+    texts = [f'page{i}' for i in range(5)]
+    monkeypatch.setattr('app.file_handler.PyPDF2.PdfReader', FakeReader)
+    monkeypatch.setattr('app.file_handler.pdfplumber.open', lambda path: FakePdf(texts))
+    
+    filepath = tmp_path / 'doc.pdf'
+    filepath.write_bytes(b'%PDF-1.4')
+    handler = FileHandler(tmp_path, {'pdf'})
+    
+    success, _, content = handler.extract_text_from_pdf(filepath)
+    assert success
+    assert content == '\n'.join(texts)
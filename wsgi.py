@@ -0,0 +1,12 @@
+"""
+AutoTagger WSGI Entry Point
+Used by production servers: gunicorn -c gunicorn.conf.py wsgi:app
+"""
+import os
+from app import create_app
+
+# Get configuration from environment or use production defaults
+config_name = os.getenv('FLASK_ENV', 'production')
+
+# Create application instance
+app = create_app(config_name)